@@ -4,7 +4,13 @@ Defines agents that use n8n webhooks for data access
 """
 from crewai import Agent, Task, Crew
 from crewai.tools import tool
+from functools import lru_cache
+from typing import Optional
+from pydantic import BaseModel
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 from dotenv import load_dotenv
 
@@ -13,6 +19,50 @@ load_dotenv()
 # n8n Webhook base URL
 N8N_BASE_URL = os.getenv("N8N_WEBHOOK_URL", "http://localhost:5678/webhook")
 
+# The large model runs the Ops Analyst, which interprets regional data. The
+# Traveler agent only looks a flight up and explains it, so its whole loop
+# (reasoning, tool selection and answer) runs on the small model.
+LLM_MODEL = f"groq/{os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile')}"
+LOOKUP_LLM_MODEL = f"groq/{os.getenv('GROQ_LOOKUP_MODEL', 'llama-3.1-8b-instant')}"
+
+# Shared HTTP session so tool calls reuse keep-alive connections to n8n
+# instead of opening a new socket on every agent step
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+
+# Response contracts of the n8n webhooks. Only the fields the tools report
+# are declared; everything else (e.g. the flight and alert lists) is ignored,
+# and a response that breaks the contract raises.
+class RegionCountResponse(BaseModel):
+    success: bool
+    total_flights: int = 0
+    timestamp: Optional[str] = None
+    error: Optional[str] = None
+
+
+class AlertsResponse(BaseModel):
+    success: bool
+    total_alerts: int = 0
+    error: Optional[str] = None
+
+
+def _decode(response, contract):
+    """Parse a webhook body once and validate it against its contract"""
+    data = orjson.loads(response.content)
+    
+    # n8n may wrap the webhook response in a single-item list
+    if isinstance(data, list) and data:
+        data = data[0]
+    
+    return contract.model_validate(data)
+
 
 # Define n8n webhook tools as CrewAI tools
 @tool
@@ -25,28 +75,31 @@ def get_region_snapshot_tool(region_name: str) -> dict:
         region_name: Name of the region to query (e.g., 'USA_East_Coast')
     """
     try:
-        url = f"{N8N_BASE_URL}/mcp/flights/list_region_snapshot?region_name={region_name}"
-        response = requests.get(url, timeout=10)
+        # n8n returns only the flight count here, not the full flight list
+        url = f"{N8N_BASE_URL}/mcp/flights/count_region?region_name={region_name}"
+        response = _SESSION.get(url, timeout=10)
+        
+        # Older workflows without the count webhook: fall back to the full
+        # snapshot, which carries the same count next to the flight list
+        if response.status_code == 404:
+            url = f"{N8N_BASE_URL}/mcp/flights/list_region_snapshot?region_name={region_name}"
+            response = _SESSION.get(url, timeout=10)
+        
         response.raise_for_status()
-        data = response.json()
+        data = _decode(response, RegionCountResponse)
         
-        # EXTREME OPTIMIZATION: Minimal data to stay under 12k token limit
-        # Even with 5 flights + alerts, we're hitting 14k tokens
-        if isinstance(data, dict) and "flights" in data and isinstance(data["flights"], list):
-            total_flights = len(data["flights"])
-            
-            # Return only SUMMARY, not individual flights
-            # This reduces ~10k tokens to ~100 tokens
-            summary = {
-                "success": True,
-                "region": region_name,
-                "total_flights": total_flights,
-                "timestamp": data.get("timestamp", "unknown"),
-                "summary_note": f"Data summarized for token efficiency. {total_flights} flights detected in this region."
-            }
-            return summary
-                
-        return data
+        if not data.success:
+            return {"success": False, "error": data.error}
+        
+        # Return only SUMMARY, not individual flights, to stay under the
+        # Groq token limit
+        return {
+            "success": True,
+            "region": region_name,
+            "total_flights": data.total_flights,
+            "timestamp": data.timestamp or "unknown",
+            "summary_note": f"Data summarized for token efficiency. {data.total_flights} flights detected in this region."
+        }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -62,7 +115,7 @@ def get_flight_by_callsign_tool(callsign: str) -> dict:
     """
     try:
         url = f"{N8N_BASE_URL}/mcp/flights/get_by_callsign?callsign={callsign}"
-        response = requests.get(url, timeout=10)
+        response = _SESSION.get(url, timeout=10)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -80,76 +133,76 @@ def get_active_alerts_tool(max_age_hours: int = 24) -> dict:
     """
     try:
         url = f"{N8N_BASE_URL}/mcp/alerts/list_active?max_age_hours={max_age_hours}"
-        response = requests.get(url, timeout=10)
+        response = _SESSION.get(url, timeout=10)
         response.raise_for_status()
-        data = response.json()
+        data = _decode(response, AlertsResponse)
         
-        # EXTREME OPTIMIZATION: Return only counts, not full alerts
-        if isinstance(data, dict) and "alerts" in data:
-            alert_count = len(data.get("alerts", []))
-            return {
-                "success": True,
-                "total_alerts": alert_count,
-                "summary_note": f"Found {alert_count} active alerts in the last {max_age_hours} hours."
-            }
+        if not data.success:
+            return {"success": False, "error": data.error}
         
-        return data
+        # EXTREME OPTIMIZATION: Return only counts, not full alerts
+        return {
+            "success": True,
+            "total_alerts": data.total_alerts,
+            "summary_note": f"Found {data.total_alerts} active alerts in the last {max_age_hours} hours."
+        }
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 
 # Create Ops Analyst Agent
-def create_ops_analyst_agent():
-    """Creates the Operations Analyst Agent that uses n8n webhooks"""
+@lru_cache(maxsize=1)
+def _ops_analyst_template():
+    """Ops Analyst configuration and LLM clients, built once per process"""
     return Agent(
         role="Airspace Operations Analyst",
         goal="Monitor regional airspace, detect anomalies, and provide actionable intelligence to operations teams",
-        backstory="""You are an experienced air traffic analyst with 15 years of experience 
-        monitoring commercial and private aviation. You have a keen eye for unusual patterns 
-        and can quickly identify potential safety concerns. Your mission is to ensure safe 
-        skies by detecting and reporting anomalies in real-time flight data.
-        
-        You use n8n webhooks to access live flight data managed by our workflow automation system.
-        n8n handles:
-        - Fetching data from OpenSky Network every 60 seconds
-        - Detecting anomalies automatically
-        - Storing snapshots and alerts
-        
-        When you query data, you're getting information directly from n8n's processed results,
-        which includes anomaly detection already performed.""",
+        backstory=(
+            "Air traffic analyst, 15 years monitoring commercial and private aviation. "
+            "Spots unusual patterns and safety concerns in live flight data. "
+            "Data: n8n webhooks over OpenSky Network, with anomaly detection already done; "
+            "focus on interpreting results."
+        ),
         verbose=True,
         allow_delegation=True,
         tools=[get_region_snapshot_tool, get_active_alerts_tool],
-        llm="groq/llama-3.3-70b-versatile"
+        llm=LLM_MODEL
     )
 
 
 # Create Traveler Support Agent
-def create_traveler_support_agent():
-    """Creates the Traveler Support Agent that uses n8n webhooks"""
+@lru_cache(maxsize=1)
+def _traveler_support_template():
+    """Traveler Support configuration and LLM clients, built once per process"""
     return Agent(
         role="Personal Flight Assistant",
         goal="Help travelers track their flights and answer questions about flight status with friendly, clear communication",
-        backstory="""You are a helpful and knowledgeable flight assistant who loves helping 
-        people track their journeys. You have access to real-time flight data managed by n8n,
-        our workflow automation system.
-        
-        You excel at:
-        - Finding specific flights by callsign or flight number
-        - Explaining flight status in plain language
-        - Providing reassurance and context about normal flight operations
-        - Recognizing when to escalate concerns to the Ops Analyst
-        
-        When you retrieve flight data, it comes from n8n webhooks which are continuously 
-        updated with the latest information from OpenSky Network. You communicate in a warm, 
-        professional manner and always ground your responses in actual flight data.""",
+        backstory=(
+            "Warm, professional flight assistant. Finds flights by callsign or ICAO24, "
+            "explains status in plain language, reassures with context on normal operations, "
+            "escalates concerns to the Ops Analyst. "
+            "Data: n8n webhooks over live OpenSky Network data; ground every answer in it."
+        ),
         verbose=True,
         allow_delegation=True,
         tools=[get_flight_by_callsign_tool, get_region_snapshot_tool],
-        llm="groq/llama-3.3-70b-versatile"
+        llm=LOOKUP_LLM_MODEL
     )
 
 
+# An Agent holds per-run state while executing a task (its agent executor
+# and the crew it belongs to), so every crew gets its own copy. copy()
+# reuses the template's LLM client.
+def create_ops_analyst_agent():
+    """Creates the Operations Analyst Agent that uses n8n webhooks"""
+    return _ops_analyst_template().copy()
+
+
+def create_traveler_support_agent():
+    """Creates the Traveler Support Agent that uses n8n webhooks"""
+    return _traveler_support_template().copy()
+
+
 # A2A Communication example: Traveler Support asks Ops Analyst
 def create_multiagent_crew(ops_agent, traveler_agent):
     """Creates a crew with both agents for A2A communication"""
@@ -2,9 +2,15 @@
 Anomaly Detection Logic
 Detects unusual flight patterns and behaviors
 """
-from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 
+import numpy as np
+
+from . import anomaly_kernel as kernel
+from .flight_arrays import FlightsSoA
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -12,25 +18,36 @@ logger = logging.getLogger(__name__)
 class AnomalyDetector:
     """Detects anomalies in flight data"""
     
-    # Thresholds for anomaly detection
+    # Thresholds for anomaly detection (for reference; the rule kernel
+    # compares against its module-level constants directly)
     THRESHOLDS = {
-        "max_altitude_meters": 15000,  # ~49,000 feet
-        "min_velocity_kmh": 100,  # Very slow for cruising
-        "max_velocity_kmh": 1000,  # Unusually fast
-        "min_altitude_high_speed": 3000,  # Low altitude threshold for high speed
-        "high_speed_threshold": 600,  # km/h
+        "max_altitude_meters": kernel.MAX_ALTITUDE_METERS,
+        "min_velocity_kmh": kernel.MIN_VELOCITY_KMH,
+        "max_velocity_kmh": kernel.MAX_VELOCITY_KMH,
+        "min_altitude_high_speed": kernel.MIN_ALTITUDE_HIGH_SPEED,
+        "high_speed_threshold": kernel.HIGH_SPEED_THRESHOLD,
         "stationary_time_seconds": 300,  # 5 minutes
-        "max_vertical_rate": 20,  # m/s (very rapid climb/descent)
+        "max_vertical_rate": kernel.MAX_VERTICAL_RATE,
     }
     
+    # Maximum number of callsigns whose last position is remembered
+    MAX_TRACKED_FLIGHTS = 10000
+    
     def __init__(self):
-        self.previous_states = {}  # Track flight states over time
+        # Last (latitude, longitude) per callsign, least recently seen first
+        self.previous_states = OrderedDict()
         logger.info("Anomaly Detector initialized")
     
-    def detect_anomalies(self, flights: List[Dict]) -> List[Dict]:
+    def detect_anomalies(self, flights: Union[List[Dict], FlightsSoA]) -> List[Dict]:
         """
         Analyze flights and detect anomalies
         
+        The threshold rules are evaluated by the vectorized rule kernel over
+        the whole flight list; per-flight Python work is only done for flights
+        that match a rule or need the stationary check against previous states.
+        A FlightsSoA is checked on its columns directly and only matching
+        flights are materialized as dicts.
+        
         Returns list of dicts with:
         - flight: original flight data
         - anomaly_type: type of anomaly
@@ -39,103 +56,121 @@ class AnomalyDetector:
         """
         anomalies = []
         
-        for flight in flights:
-            flight_anomalies = self._check_flight(flight)
-            if flight_anomalies:
-                anomalies.extend(flight_anomalies)
-        
-        logger.info(f"Detected {len(anomalies)} anomalies out of {len(flights)} flights")
-        return anomalies
-    
-    def _check_flight(self, flight: Dict) -> List[Dict]:
-        """Check a single flight for anomalies"""
-        anomalies = []
-        
-        # Skip if on ground
-        if flight.get("on_ground"):
-            return anomalies
-        
-        callsign = flight.get("callsign") or flight.get("icao24")
-        altitude = flight.get("altitude")
-        velocity = flight.get("velocity")
-        vertical_rate = flight.get("vertical_rate")
+        if isinstance(flights, FlightsSoA):
+            codes = kernel.classify(flights.altitude, flights.velocity, flights.vertical_rate, flights.on_ground)
+            flight_at = flights.record
+        else:
+            altitude = self._column(flights, "altitude")
+            velocity = self._column(flights, "velocity")
+            vertical_rate = self._column(flights, "vertical_rate")
+            on_ground = np.fromiter((bool(f.get("on_ground")) for f in flights), dtype=bool, count=len(flights))
+            codes = kernel.classify(altitude, velocity, vertical_rate, on_ground)
+            flight_at = flights.__getitem__
         
-        # Check 1: High altitude with low speed
-        if altitude and velocity:
-            if altitude > 8000 and velocity < self.THRESHOLDS["min_velocity_kmh"]:
+        # Walk matches in flight order so anomalies keep the per-flight check order
+        for i in np.flatnonzero(codes):
+            code = codes[i]
+            flight = flight_at(i)
+            callsign = flight.get("callsign") or flight.get("icao24")
+            altitude_i = flight.get("altitude")
+            velocity_i = flight.get("velocity")
+            
+            # Check 1: High altitude with low speed
+            if code & kernel.HIGH_ALTITUDE_LOW_SPEED:
                 anomalies.append({
                     "flight": flight,
                     "anomaly_type": "high_altitude_low_speed",
                     "severity": "medium",
-                    "description": f"Flight {callsign} at {altitude}m with only {velocity} km/h"
+                    "description": f"Flight {callsign} at {altitude_i}m with only {velocity_i} km/h"
                 })
-        
-        # Check 2: Extremely high altitude
-        if altitude and altitude > self.THRESHOLDS["max_altitude_meters"]:
-            anomalies.append({
-                "flight": flight,
-                "anomaly_type": "excessive_altitude",
-                "severity": "high",
-                "description": f"Flight {callsign} at unusual altitude: {altitude}m"
-            })
-        
-        # Check 3: High speed at low altitude
-        if altitude and velocity:
-            if altitude < self.THRESHOLDS["min_altitude_high_speed"] and velocity > self.THRESHOLDS["high_speed_threshold"]:
+            
+            # Check 2: Extremely high altitude
+            if code & kernel.EXCESSIVE_ALTITUDE:
+                anomalies.append({
+                    "flight": flight,
+                    "anomaly_type": "excessive_altitude",
+                    "severity": "high",
+                    "description": f"Flight {callsign} at unusual altitude: {altitude_i}m"
+                })
+            
+            # Check 3: High speed at low altitude
+            if code & kernel.LOW_ALTITUDE_HIGH_SPEED:
                 anomalies.append({
                     "flight": flight,
                     "anomaly_type": "low_altitude_high_speed",
                     "severity": "high",
-                    "description": f"Flight {callsign} at {velocity} km/h at only {altitude}m altitude"
+                    "description": f"Flight {callsign} at {velocity_i} km/h at only {altitude_i}m altitude"
                 })
-        
-        # Check 4: Rapid vertical movement
-        if vertical_rate and abs(vertical_rate) > self.THRESHOLDS["max_vertical_rate"]:
-            direction = "climbing" if vertical_rate > 0 else "descending"
-            anomalies.append({
-                "flight": flight,
-                "anomaly_type": "rapid_vertical_movement",
-                "severity": "medium",
-                "description": f"Flight {callsign} {direction} rapidly at {abs(vertical_rate)} m/s"
-            })
-        
-        # Check 5: Unusual velocity
-        if velocity:
-            if velocity > self.THRESHOLDS["max_velocity_kmh"]:
+            
+            # Check 4: Rapid vertical movement
+            if code & kernel.RAPID_VERTICAL_MOVEMENT:
+                vertical_rate_i = flight.get("vertical_rate")
+                direction = "climbing" if vertical_rate_i > 0 else "descending"
+                anomalies.append({
+                    "flight": flight,
+                    "anomaly_type": "rapid_vertical_movement",
+                    "severity": "medium",
+                    "description": f"Flight {callsign} {direction} rapidly at {abs(vertical_rate_i)} m/s"
+                })
+            
+            # Check 5: Unusual velocity
+            if code & kernel.EXCESSIVE_SPEED:
                 anomalies.append({
                     "flight": flight,
                     "anomaly_type": "excessive_speed",
                     "severity": "medium",
-                    "description": f"Flight {callsign} traveling at {velocity} km/h (unusually fast)"
+                    "description": f"Flight {callsign} traveling at {velocity_i} km/h (unusually fast)"
                 })
-        
-        # Check 6: Stationary in air (checking with historical data)
-        if callsign and velocity is not None and velocity < 50:
-            # Check if this is consistent over time
-            if callsign in self.previous_states:
-                prev_lat = self.previous_states[callsign].get("latitude")
-                prev_lon = self.previous_states[callsign].get("longitude")
-                curr_lat = flight.get("latitude")
-                curr_lon = flight.get("longitude")
-                
-                if prev_lat and prev_lon and curr_lat and curr_lon:
-                    # Simple distance check (very rough approximation)
-                    lat_diff = abs(curr_lat - prev_lat)
-                    lon_diff = abs(curr_lon - prev_lon)
-                    
-                    if lat_diff < 0.01 and lon_diff < 0.01 and not flight.get("on_ground"):
-                        anomalies.append({
-                            "flight": flight,
-                            "anomaly_type": "stationary_in_air",
-                            "severity": "high",
-                            "description": f"Flight {callsign} appears stationary in air"
-                        })
             
-            # Update previous state
-            self.previous_states[callsign] = flight
+            # Check 6: Stationary in air (checking with historical data)
+            if code & kernel.SLOW_AIRBORNE and callsign:
+                anomaly = self._check_stationary(flight, callsign)
+                if anomaly:
+                    anomalies.append(anomaly)
         
+        logger.info(f"Detected {len(anomalies)} anomalies out of {len(flights)} flights")
         return anomalies
     
+    @staticmethod
+    def _column(flights: List[Dict], key: str) -> np.ndarray:
+        """Extract a numeric flight field as a float array (missing -> NaN)"""
+        return np.fromiter(
+            (np.nan if f.get(key) is None else f.get(key) for f in flights),
+            dtype=np.float64,
+            count=len(flights)
+        )
+    
+    def _check_stationary(self, flight: Dict, callsign: str) -> Optional[Dict]:
+        """Compare a slow airborne flight against its previous position"""
+        anomaly = None
+        
+        curr_lat = flight.get("latitude")
+        curr_lon = flight.get("longitude")
+        
+        # Check if this is consistent over time
+        if callsign in self.previous_states:
+            prev_lat, prev_lon = self.previous_states[callsign]
+            
+            if prev_lat and prev_lon and curr_lat and curr_lon:
+                # Simple distance check (very rough approximation)
+                lat_diff = abs(curr_lat - prev_lat)
+                lon_diff = abs(curr_lon - prev_lon)
+                
+                if lat_diff < 0.01 and lon_diff < 0.01:
+                    anomaly = {
+                        "flight": flight,
+                        "anomaly_type": "stationary_in_air",
+                        "severity": "high",
+                        "description": f"Flight {callsign} appears stationary in air"
+                    }
+        
+        # Update previous state, evicting the least recently seen flight
+        self.previous_states[callsign] = (curr_lat, curr_lon)
+        self.previous_states.move_to_end(callsign)
+        if len(self.previous_states) > self.MAX_TRACKED_FLIGHTS:
+            self.previous_states.popitem(last=False)
+        return anomaly
+    
     def generate_summary(self, flights: List[Dict], anomalies: List[Dict], region_name: str) -> str:
         """
         Generate natural language summary of the region
@@ -154,19 +189,29 @@ class AnomalyDetector:
         
         summary += f" {total_anomalies} flight(s) are flagged as anomalous."
         
-        # Group anomalies by severity
-        critical = [a for a in anomalies if a["severity"] == "high"]
-        medium = [a for a in anomalies if a["severity"] == "medium"]
+        # Group anomalies by severity in a single pass, counting all of them
+        # but keeping only the ones listed in the summary
+        critical, medium = [], []
+        critical_count = medium_count = 0
+        for anomaly in anomalies:
+            if anomaly["severity"] == "high":
+                critical_count += 1
+                if len(critical) < 3:  # Top 3 critical
+                    critical.append(anomaly)
+            elif anomaly["severity"] == "medium":
+                medium_count += 1
+                if len(medium) < 2:  # Top 2 medium
+                    medium.append(anomaly)
         
         if critical:
-            summary += f"\n\nCRITICAL ALERTS ({len(critical)}):"
-            for anomaly in critical[:3]:  # Top 3 critical
+            summary += f"\n\nCRITICAL ALERTS ({critical_count}):"
+            for anomaly in critical:
                 callsign = anomaly["flight"].get("callsign") or anomaly["flight"].get("icao24")
                 summary += f"\n  - {callsign}: {anomaly['description']}"
         
         if medium:
-            summary += f"\n\nMedium Priority ({len(medium)}):"
-            for anomaly in medium[:2]:  # Top 2 medium
+            summary += f"\n\nMedium Priority ({medium_count}):"
+            for anomaly in medium:
                 callsign = anomaly["flight"].get("callsign") or anomaly["flight"].get("icao24")
                 summary += f"\n  - {callsign}: {anomaly['description']}"
         
@@ -0,0 +1,48 @@
+"""
+Anomaly Rule Kernel
+Vectorized threshold checks over flight data columns
+"""
+import numpy as np
+
+# Rule thresholds (AnomalyDetector.THRESHOLDS exposes the same values)
+MAX_ALTITUDE_METERS = 15000  # ~49,000 feet
+MIN_VELOCITY_KMH = 100  # Very slow for cruising
+MAX_VELOCITY_KMH = 1000  # Unusually fast
+MIN_ALTITUDE_HIGH_SPEED = 3000  # Low altitude threshold for high speed
+HIGH_SPEED_THRESHOLD = 600  # km/h
+MAX_VERTICAL_RATE = 20  # m/s (very rapid climb/descent)
+CRUISE_ALTITUDE_METERS = 8000  # Altitude above which low speed is unusual
+STATIONARY_MAX_VELOCITY = 50  # Slow enough to check for a stationary flight
+
+# Rule flags in the code returned by classify(), in the order checks are
+# reported per flight
+HIGH_ALTITUDE_LOW_SPEED = 1 << 0
+EXCESSIVE_ALTITUDE = 1 << 1
+LOW_ALTITUDE_HIGH_SPEED = 1 << 2
+RAPID_VERTICAL_MOVEMENT = 1 << 3
+EXCESSIVE_SPEED = 1 << 4
+SLOW_AIRBORNE = 1 << 5  # Candidate for the stationary-in-air check
+
+
+def classify(altitude: np.ndarray, velocity: np.ndarray, vertical_rate: np.ndarray,
+             on_ground: np.ndarray) -> np.ndarray:
+    """
+    Evaluate all threshold rules over the flight columns without branching
+
+    Missing values must be NaN, so every comparison is False for them.
+    Zero altitude/velocity never triggers the combined rules.
+
+    Returns a uint8 array with one rule-flag bitmask per flight (0 = no rule hit)
+    """
+    code = (
+        ((altitude > CRUISE_ALTITUDE_METERS) & (velocity < MIN_VELOCITY_KMH) & (velocity != 0)).view(np.uint8)
+        | (altitude > MAX_ALTITUDE_METERS).view(np.uint8) << 1
+        | ((altitude < MIN_ALTITUDE_HIGH_SPEED) & (altitude != 0) & (velocity > HIGH_SPEED_THRESHOLD)).view(np.uint8) << 2
+        | (np.abs(vertical_rate) > MAX_VERTICAL_RATE).view(np.uint8) << 3
+        | (velocity > MAX_VELOCITY_KMH).view(np.uint8) << 4
+        | (velocity < STATIONARY_MAX_VELOCITY).view(np.uint8) << 5
+    )
+
+    # Flights on the ground are never anomalous
+    code *= ~on_ground
+    return code
@@ -0,0 +1,86 @@
+"""
+Flight Arrays
+Column-oriented (structure-of-arrays) view of OpenSky state vectors
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from shared import MIN_STATE_LENGTH, flight_record
+
+# Positions of the numeric fields in an OpenSky state vector
+LONGITUDE, LATITUDE, ALTITUDE, ON_GROUND, VELOCITY, HEADING, VERTICAL_RATE = 5, 6, 7, 8, 9, 10, 11
+
+
+def _numeric(states: List[List], index: int) -> np.ndarray:
+    """Extract a numeric state field as a float array (None -> NaN)"""
+    return np.array([s[index] for s in states], dtype=np.float64)
+
+
+@dataclass
+class FlightsSoA:
+    """
+    Flights of one snapshot as one array per field
+
+    Numeric fields are float64 with NaN for missing values, so rule checks
+    run directly on the columns. The source state vectors are kept so that
+    per-flight dicts are only built for the flights that are actually needed,
+    with exactly the values OpenSky sent.
+    """
+    states: List[List]
+    longitude: np.ndarray
+    latitude: np.ndarray
+    altitude: np.ndarray
+    velocity: np.ndarray
+    heading: np.ndarray
+    vertical_rate: np.ndarray
+    on_ground: np.ndarray
+
+    @classmethod
+    def from_states(cls, states: Optional[List[List]]) -> "FlightsSoA":
+        """Build the columns from an OpenSky "states" list (None when empty)"""
+        # The state vector layout is fixed, so checking the first one covers all
+        states = states if states and len(states[0]) >= MIN_STATE_LENGTH else []
+        return cls(
+            states=states,
+            longitude=_numeric(states, LONGITUDE),
+            latitude=_numeric(states, LATITUDE),
+            altitude=_numeric(states, ALTITUDE),
+            velocity=_numeric(states, VELOCITY),
+            heading=_numeric(states, HEADING),
+            vertical_rate=_numeric(states, VERTICAL_RATE),
+            on_ground=np.array([bool(s[ON_GROUND]) for s in states], dtype=bool),
+        )
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def within(self, bounding_box: Dict) -> np.ndarray:
+        """Row indices of flights inside a min_lat/max_lat/min_lon/max_lon box (inclusive)"""
+        mask = (
+            (self.latitude >= bounding_box["min_lat"]) & (self.latitude <= bounding_box["max_lat"])
+            & (self.longitude >= bounding_box["min_lon"]) & (self.longitude <= bounding_box["max_lon"])
+        )
+        return np.flatnonzero(mask)
+
+    def take(self, rows: np.ndarray) -> "FlightsSoA":
+        """Subset of the flights at the given row indices"""
+        return FlightsSoA(
+            states=[self.states[i] for i in rows],
+            longitude=self.longitude[rows],
+            latitude=self.latitude[rows],
+            altitude=self.altitude[rows],
+            velocity=self.velocity[rows],
+            heading=self.heading[rows],
+            vertical_rate=self.vertical_rate[rows],
+            on_ground=self.on_ground[rows],
+        )
+
+    def record(self, i: int) -> Dict:
+        """Materialize flight i as the dict used by detectors and alerts"""
+        return flight_record(self.states[i])
+
+    def to_records(self) -> List[Dict]:
+        """Materialize every flight (for callers that still expect a list of dicts)"""
+        return [self.record(i) for i in range(len(self.states))]
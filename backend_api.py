@@ -4,60 +4,170 @@ Called by n8n workflows for file operations
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-import json
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime, timedelta
 
-app = FastAPI()
+from json_response import ORJSONResponse
+from shared import SNAPSHOT_CACHE_SIZE, flight_record, read_json, settled_mtime, snapshot_states
+
+app = FastAPI(default_response_class=ORJSONResponse)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
 DATA_DIR = Path(__file__).parent / "data"
 SNAPSHOT_DIR = DATA_DIR / "snapshots"
 ALERTS_DIR = DATA_DIR / "alerts"
 
+# Shared pool for overlapping many small alert file reads
+_IO_POOL = ThreadPoolExecutor(max_workers=16)
+
+# Snapshot directory index, rebuilt only when files are added or removed
+_SNAP_INDEX: dict[str, tuple[Path, float]] = {}  # region -> (latest file, mtime)
+_SNAP_FILES: list[Path] = []  # all snapshots, newest first
+_SNAP_DIR_MTIME = None
+
+def _refresh_index():
+    """Rescan the snapshot directory if its mtime changed since the last scan"""
+    global _SNAP_INDEX, _SNAP_FILES, _SNAP_DIR_MTIME
+    dir_mtime = SNAPSHOT_DIR.stat().st_mtime_ns
+    if dir_mtime == _SNAP_DIR_MTIME:
+        return
+    
+    index, files = {}, []
+    with os.scandir(SNAPSHOT_DIR) as entries:
+        for e in entries:
+            if not e.name.endswith(".json"):
+                continue
+            mt = e.stat().st_mtime
+            region = e.name.rsplit("_", 1)[0]
+            files.append((mt, Path(e.path)))
+            if mt > index.get(region, (None, -1.0))[1]:
+                index[region] = (Path(e.path), mt)
+    
+    files.sort(reverse=True)
+    _SNAP_INDEX, _SNAP_FILES = index, [f for _, f in files]
+    _SNAP_DIR_MTIME = settled_mtime(dir_mtime)
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _load_json_cached(path: str, mtime_ns: int) -> dict:
+    """Parse a snapshot file; mtime_ns in the key invalidates rewritten files.
+    The returned dict is shared between requests and must not be mutated."""
+    return read_json(path)
+
+def _load_snapshot(path: Path) -> dict:
+    return _load_json_cached(str(path), path.stat().st_mtime_ns)
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _state_keys_cached(path: str, mtime_ns: int) -> dict[str, int]:
+    """Normalized CALLSIGN / ICAO24 -> first matching state index in one snapshot"""
+    data = _load_json_cached(path, mtime_ns)
+    keys = {}
+    for i, s in enumerate(snapshot_states(data)):
+        keys.setdefault(s[1].strip().upper() if s[1] else "", i)
+        keys.setdefault(s[0].upper(), i)
+    return keys
+
+# CALLSIGN / ICAO24 -> (snapshot file, state index) over the 10 newest snapshots
+_FLIGHT_INDEX: dict[str, tuple[Path, int]] = {}
+_FLIGHT_INDEX_MTIME = -1
+
+def _flight_index() -> dict[str, tuple[Path, int]]:
+    """Return the flight lookup index, rebuilding it when snapshots changed"""
+    global _FLIGHT_INDEX, _FLIGHT_INDEX_MTIME
+    _refresh_index()
+    # Read the generation before the file list so a concurrent rescan can
+    # only cause an extra rebuild, never a stale index
+    generation, files = _SNAP_DIR_MTIME, _SNAP_FILES
+    # Generation None means the directory was modified too recently to trust
+    if generation is not None and generation == _FLIGHT_INDEX_MTIME:
+        return _FLIGHT_INDEX
+    
+    # Oldest first so newer snapshots overwrite older entries; only files
+    # not seen before are parsed and normalized
+    index = {}
+    for file in reversed(files[:10]):
+        keys = _state_keys_cached(str(file), file.stat().st_mtime_ns)
+        index.update({k: (file, i) for k, i in keys.items()})
+    
+    _FLIGHT_INDEX, _FLIGHT_INDEX_MTIME = index, generation
+    return index
+
+# Column name -> OpenSky state vector position, for format=columns responses
+SNAPSHOT_COLUMNS = {"icao24": 0, "callsign": 1, "origin_country": 2, "longitude": 5, "latitude": 6,
+                    "altitude": 7, "on_ground": 8, "velocity": 9, "heading": 10, "vertical_rate": 11}
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _snapshot_columns_cached(path: str, mtime_ns: int) -> dict:
+    """Transpose a snapshot's states into one list per column"""
+    data = _load_json_cached(path, mtime_ns)
+    states = snapshot_states(data)
+    values = list(zip(*states)) or [()] * 12
+    columns = {name: values[i] for name, i in SNAPSHOT_COLUMNS.items()}
+    columns["callsign"] = [c.strip() if c else None for c in columns["callsign"]]
+    return {"timestamp": data.get("timestamp"), "total_flights": len(states), "columns": columns}
+
 @app.get("/api/snapshot")
-def get_snapshot(region_name: str = "USA_East_Coast"):
-    """Get latest snapshot"""
-    files = list(SNAPSHOT_DIR.glob(f"{region_name}_*.json"))
-    if not files:
+def get_snapshot(region_name: str = "USA_East_Coast", format: str = "records"):
+    """Get latest snapshot, as a list of flight records or (format=columns) one array per field"""
+    _refresh_index()
+    if region_name not in _SNAP_INDEX:
         return {"success": False, "error": f"No data for {region_name}", "flights": []}
     
-    latest = max(files, key=lambda f: f.stat().st_mtime)
-    data = json.loads(latest.read_text())
+    latest = _SNAP_INDEX[region_name][0]
+    if format == "columns":
+        snap = _snapshot_columns_cached(str(latest), latest.stat().st_mtime_ns)
+        # Returned as a response directly so the cached columns go straight to orjson
+        return ORJSONResponse({"success": True, "region": region_name, **snap})
     
-    flights = []
-    if "data" in data and "states" in data["data"]:
-        for s in data["data"]["states"]:
-            if len(s) >= 12:
-                flights.append({"icao24": s[0], "callsign": s[1].strip() if s[1] else None, "origin_country": s[2], 
-                               "longitude": s[5], "latitude": s[6], "altitude": s[7], "on_ground": s[8],
-                               "velocity": s[9], "heading": s[10], "vertical_rate": s[11]})
+    data = _load_snapshot(latest)
+    
+    flights = [flight_record(s) for s in snapshot_states(data)]
     
     return {"success": True, "region": region_name, "timestamp": data.get("timestamp"), 
             "total_flights": len(flights), "flights": flights}
 
+@app.get("/api/snapshot/count")
+def count_snapshot(region_name: str = "USA_East_Coast"):
+    """Get flight count of latest snapshot without the flight list"""
+    _refresh_index()
+    if region_name not in _SNAP_INDEX:
+        return {"success": False, "error": f"No data for {region_name}", "total_flights": 0}
+    
+    latest = _SNAP_INDEX[region_name][0]
+    data = _load_snapshot(latest)
+    
+    return {"success": True, "region": region_name, "timestamp": data.get("timestamp"),
+            "total_flights": len(snapshot_states(data))}
+
 @app.get("/api/flight")
 def get_flight(callsign: str):
     """Find flight by callsign"""
     callsign = callsign.strip().upper()
-    for file in sorted(SNAPSHOT_DIR.glob("*.json"), key=lambda f: f.stat().st_mtime, reverse=True)[:10]:
-        data = json.loads(file.read_text())
-        if "data" in data and "states" in data["data"]:
-            for s in data["data"]["states"]:
-                if len(s) >= 12:
-                    cs = s[1].strip().upper() if s[1] else ""
-                    if cs == callsign or s[0].upper() == callsign:
-                        return {"success": True, "flight": {"icao24": s[0], "callsign": s[1].strip() if s[1] else None,
-                                "origin_country": s[2], "longitude": s[5], "latitude": s[6], "altitude": s[7],
-                                "on_ground": s[8], "velocity": s[9], "heading": s[10], "vertical_rate": s[11]}}
+    ref = _flight_index().get(callsign)
+    if ref:
+        file, i = ref
+        s = _load_snapshot(file)["data"]["states"][i]
+        return {"success": True, "flight": flight_record(s)}
     return {"success": False, "error": f"Flight {callsign} not found"}
 
+def _recent_alert_paths(cutoff: float) -> list[str]:
+    with os.scandir(ALERTS_DIR) as entries:
+        return [e.path for e in entries if e.name.endswith(".json") and e.stat().st_mtime >= cutoff]
+
 @app.get("/api/alerts")
-def get_alerts(max_age_hours: int = 24):
+async def get_alerts(max_age_hours: int = 24):
     """Get active alerts"""
-    cutoff = datetime.now() - timedelta(hours=max_age_hours)
-    alerts = [json.loads(f.read_text()) for f in ALERTS_DIR.glob("*.json") 
-              if datetime.fromtimestamp(f.stat().st_mtime) >= cutoff]
+    # File IO runs on the dedicated pool; the endpoint awaits it instead of
+    # holding a request worker while the reads fan out
+    loop = asyncio.get_running_loop()
+    cutoff = (datetime.now() - timedelta(hours=max_age_hours)).timestamp()
+    paths = await loop.run_in_executor(_IO_POOL, _recent_alert_paths, cutoff)
+    contents = await asyncio.gather(*(loop.run_in_executor(_IO_POOL, read_json, p) for p in paths))
+    # A file holds one alert, or a list of alerts saved as a batch
+    alerts = [a for c in contents for a in (c if isinstance(c, list) else [c])]
     alerts.sort(key=lambda a: a.get("timestamp", ""), reverse=True)
     return {"success": True, "total_alerts": len(alerts), "alerts": alerts}
 
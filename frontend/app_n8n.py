@@ -3,10 +3,15 @@ Streamlit Frontend - n8n Integration
 Beautiful UI using n8n webhooks for data access
 """
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit_autorefresh import st_autorefresh
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import time
+import functools
+import logging
 import sys
 import os
 
@@ -21,6 +26,8 @@ from agents.agent_config_n8n import (
 )
 from crewai import Crew
 
+logger = logging.getLogger(__name__)
+
 # Page config
 st.set_page_config(
     page_title="✈️ Airspace Copilot",
@@ -49,62 +56,149 @@ st.markdown("""
 N8N_BASE_URL = os.getenv("N8N_WEBHOOK_URL", "http://localhost:5678/webhook")
 
 
+@st.cache_resource
+def get_http_session():
+    """Shared HTTP session, kept across Streamlit reruns so n8n connections stay alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "airspace-copilot-frontend"
+    return session
+
+
+class _FailedResponse(Exception):
+    """Carries a failure result out of a cached fetch, so it is not cached"""
+    def __init__(self, result):
+        super().__init__(result.get("error"))
+        self.result = result
+
+
+def _uncached_failures(fetch):
+    """Return failures of a cached fetch as {"success": False, ...} without caching them
+
+    st.cache_data does not cache a call that raises, so a timeout or a
+    "not found" answer is retried on the next rerun instead of sticking
+    until the TTL expires.
+    """
+    @functools.wraps(fetch)
+    def wrapper(*args):
+        try:
+            return fetch(*args)
+        except _FailedResponse as e:
+            return e.result
+        except Exception as e:
+            logger.debug("%s failed: %s", fetch.__name__, e)
+            return {"success": False, "error": str(e)}
+    wrapper.clear = fetch.clear
+    return wrapper
+
+
+def _checked(data):
+    """Raise an explicit n8n failure response so it stays out of the cache"""
+    if isinstance(data, dict) and data.get("success") is False:
+        raise _FailedResponse(data)
+    return data
+
+
+# n8n responses are cached briefly: the Data Fetcher only refreshes snapshots
+# every few minutes, while Streamlit reruns on every widget interaction.
+# Only successful responses are cached.
+@st.cache_data(ttl=10, show_spinner=False)
+def _n8n_reachable():
+    get_http_session().get("http://localhost:5678", timeout=5)  # Raises when n8n is down
+    return True
+
+
 def check_n8n_status():
     """Check if n8n is running"""
     try:
-        response = requests.get("http://localhost:5678", timeout=5)
-        return True
-    except:
+        return _n8n_reachable()
+    except Exception:
         return False
 
 
+@_uncached_failures
+@st.cache_data(ttl=60, show_spinner=False)
 def get_region_data(region_name):
     """Fetch region snapshot from n8n webhook"""
-    try:
-        url = f"{N8N_BASE_URL}/mcp/flights/list_region_snapshot?region_name={region_name}"
-        print(f"🔍 CALLING: {url}")  # DEBUG
-        response = requests.get(url, timeout=10)
-        print(f"✅ STATUS: {response.status_code}")  # DEBUG
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        # DEBUGGING STRUCTURE
-        print(f"🔍 DEBUG INFO:")
-        print(f"• Type: {type(data)}")
-        if isinstance(data, list):
-            print(f"• List Length: {len(data)}")
-            if len(data) > 0:
-                print(f"• First Item Keys: {data[0].keys() if isinstance(data[0], dict) else 'Not a dict'}")
-                data = data[0] # Try unwrapping
-        elif isinstance(data, dict):
-            print(f"• Keys: {list(data.keys())}")
-        
-        print(f"📊 FLIGHTS KEY: {data.get('total_flights', 'MISSING')}")
-        return data
-    except Exception as e:
-        print(f"❌ ERROR: {str(e)}")  # DEBUG
-        return {"success": False, "error": str(e)}
+    url = f"{N8N_BASE_URL}/mcp/flights/list_region_snapshot?region_name={region_name}"
+    response = get_http_session().get(url, timeout=10)
+    logger.debug("GET %s -> %s", url, response.status_code)
+    response.raise_for_status()
+    
+    data = response.json()
+    
+    # n8n may wrap the webhook response in a single-item list
+    if isinstance(data, list) and data:
+        data = data[0]
+    
+    logger.debug("total_flights=%s", data.get("total_flights"))
+    return _checked(data)
+
+
+@_uncached_failures
+@st.cache_data(ttl=30, show_spinner=False)
 def get_flight_data(callsign):
     """Fetch specific flight data from n8n webhook"""
-    try:
-        url = f"{N8N_BASE_URL}/mcp/flights/get_by_callsign?callsign={callsign}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+    url = f"{N8N_BASE_URL}/mcp/flights/get_by_callsign?callsign={callsign}"
+    response = get_http_session().get(url, timeout=10)
+    response.raise_for_status()
+    return _checked(response.json())
 
 
+@_uncached_failures
+@st.cache_data(ttl=30, show_spinner=False)
 def get_active_alerts():
     """Fetch active alerts from n8n webhook"""
-    try:
-        url = f"{N8N_BASE_URL}/mcp/alerts/list_active"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+    url = f"{N8N_BASE_URL}/mcp/alerts/list_active"
+    response = get_http_session().get(url, timeout=10)
+    response.raise_for_status()
+    return _checked(response.json())
+
+
+def fetch_ops_bundle(region_name):
+    """Fetch region snapshot and active alerts concurrently"""
+    # Worker threads need the script context to use the st.cache_data helpers
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2, initializer=lambda: add_script_run_ctx(ctx=ctx)) as pool:
+        region_future = pool.submit(get_region_data, region_name)
+        alerts_future = pool.submit(get_active_alerts)
+        return region_future.result(), alerts_future.result()
+
+
+@st.cache_resource
+def get_crew_executor():
+    """Thread pool shared by all sessions for CrewAI runs"""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+def start_crew(job_key, create_agent, create_task, *task_args):
+    """Kick off a single-agent crew in the background and remember its future
+
+    Jobs run concurrently across sessions and an Agent keeps per-run state,
+    so the agent is created here for this job alone.
+    """
+    agent = create_agent()
+    task = create_task(agent, *task_args)
+    crew = Crew(agents=[agent], tasks=[task], verbose=False)
+    st.session_state[job_key] = get_crew_executor().submit(crew.kickoff)
+
+
+def finished_crew(job_key):
+    """Pop and return the crew future once it has completed"""
+    job = st.session_state.get(job_key)
+    if job is not None and job.done():
+        return st.session_state.pop(job_key)
+    return None
+
+
+def show_crew_progress(job_key, label):
+    """Show a running crew and rerun until it finishes"""
+    if job_key in st.session_state:
+        # The script thread is not held while the LLM works; reruns poll the job
+        st.status(label, state="running")
+        st_autorefresh(interval=2000, key=f"{job_key}_poll")
 
 
 # Header
@@ -234,35 +328,41 @@ if "👤 Traveler" in mode:
     if "chat_history" not in st.session_state:
         st.session_state["chat_history"] = []
     
+    # Collect a finished agent answer before rendering the history
+    job = finished_crew("traveler_job")
+    if job is not None:
+        try:
+            response = str(job.result())
+        except Exception as e:
+            response = f"Sorry, error: {str(e)}"
+        st.session_state["chat_history"].append({"role": "assistant", "content": response})
+    
     for message in st.session_state["chat_history"]:
         if message["role"] == "user":
             st.chat_message("user").write(message["content"])
         else:
             st.chat_message("assistant").write(message["content"])
     
-    user_question = st.chat_input("Ask about your flight...")
+    user_question = st.chat_input(
+        "Ask about your flight...",
+        disabled="traveler_job" in st.session_state
+    )
     
     if user_question and flight_id:
         st.session_state["chat_history"].append({"role": "user", "content": user_question})
         st.chat_message("user").write(user_question)
         
+        try:
+            start_crew("traveler_job", create_traveler_support_agent, create_traveler_query_task,
+                       flight_id, user_question)
+        except Exception as e:
+            error_msg = f"Sorry, error: {str(e)}"
+            st.chat_message("assistant").error(error_msg)
+            st.session_state["chat_history"].append({"role": "assistant", "content": error_msg})
+    
+    if "traveler_job" in st.session_state:
         with st.chat_message("assistant"):
-            with st.spinner("Agent thinking (via n8n data)..."):
-                try:
-                    traveler_agent = create_traveler_support_agent()
-                    task = create_traveler_query_task(traveler_agent, flight_id, user_question)
-                    crew = Crew(agents=[traveler_agent], tasks=[task], verbose=False)
-                    
-                    result = crew.kickoff()
-                    response = str(result)
-                    
-                    st.write(response)
-                    st.session_state["chat_history"].append({"role": "assistant", "content": response})
-                    
-                except Exception as e:
-                    error_msg = f"Sorry, error: {str(e)}"
-                    st.error(error_msg)
-                    st.session_state["chat_history"].append({"role": "assistant", "content": error_msg})
+            show_crew_progress("traveler_job", "Agent thinking (via n8n data)...")
 
 else:
     # OPERATIONS MODE
@@ -283,11 +383,17 @@ else:
         fetch_button = st.button("🔄 Fetch Latest", type="primary", width="stretch")
         auto_refresh = st.checkbox("Auto-refresh (60s)", value=False)
     
+    if fetch_button:
+        # An explicit fetch bypasses the response cache
+        get_region_data.clear()
+        get_active_alerts.clear()
+    
     if fetch_button or auto_refresh or "region_data" not in st.session_state:
         if region_name:
             with st.spinner(f"Querying n8n for {region_name}..."):
-                region_data = get_region_data(region_name)
+                region_data, alerts_data = fetch_ops_bundle(region_name)
                 st.session_state["region_data"] = region_data
+                st.session_state["alerts_data"] = alerts_data
                 st.session_state["last_update"] = datetime.now()
     
     if "last_update" in st.session_state:
@@ -305,7 +411,7 @@ else:
             with col1:
                 st.metric("Total Flights", len(flights))
             with col2:
-                alerts_data = get_active_alerts()
+                alerts_data = st.session_state.get("alerts_data", {})
                 total_alerts = len(alerts_data.get("alerts", []))
                 st.metric("Active Alerts", total_alerts)
             with col3:
@@ -314,9 +420,10 @@ else:
             st.markdown("### Flight List")
             
             if flights:
-                df = pd.DataFrame(flights)
                 display_cols = ["callsign", "altitude", "velocity", "heading", "origin_country"]
-                df_display = df[display_cols].copy()
+                df_display = pd.DataFrame.from_records(flights, columns=display_cols).astype(
+                    {"altitude": "float64", "velocity": "float64", "heading": "float64", "origin_country": "category"}
+                )
                 df_display.columns = ["Callsign", "Altitude (m)", "Speed (km/h)", "Heading", "Country"]
                 
                 st.dataframe(df_display, use_container_width=True, height=400)
@@ -324,29 +431,29 @@ else:
                 st.markdown("---")
                 st.subheader("🤖 AI Analysis (n8n Data)")
                 
-                if st.button("Generate Summary", type="secondary"):
-                    with st.spinner("Ops Analyst analyzing n8n data..."):
-                        try:
-                            ops_agent = create_ops_analyst_agent()
-                            task = create_ops_analysis_task(ops_agent, region_name)
-                            crew = Crew(agents=[ops_agent], tasks=[task], verbose=False)
-                            
-                            result = crew.kickoff()
-                            summary = str(result)
-                            
-                            st.success("✅ Analysis complete")
-                            st.markdown(summary)
-                            
-                        except Exception as e:
-                            st.error(f"Analysis failed: {str(e)}")
+                if st.button("Generate Summary", type="secondary", disabled="ops_job" in st.session_state):
+                    try:
+                        start_crew("ops_job", create_ops_analyst_agent, create_ops_analysis_task, region_name)
+                    except Exception as e:
+                        st.error(f"Analysis failed: {str(e)}")
+                
+                job = finished_crew("ops_job")
+                if job is not None:
+                    try:
+                        summary = str(job.result())
+                        st.success("✅ Analysis complete")
+                        st.markdown(summary)
+                    except Exception as e:
+                        st.error(f"Analysis failed: {str(e)}")
+                show_crew_progress("ops_job", "Ops Analyst analyzing n8n data...")
             else:
                 st.info("No flights currently in this region.")
         else:
             st.error(f"Failed to fetch from n8n: {data.get('error')}")
     
     if auto_refresh:
-        time.sleep(60)
-        st.rerun()
+        # Browser-side timer: the script thread is free between reruns
+        st_autorefresh(interval=60_000, key="ops_refresh_tick")
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,12 @@
+"""
+JSON Response
+orjson-backed FastAPI response class used by backend_api and mcp_server
+"""
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response serialized with orjson"""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
@@ -2,17 +2,115 @@
 Data Store Manager
 Handles storage and retrieval of flight snapshots and alerts
 """
-import json
 import os
+import time
+from bisect import bisect_left
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 import logging
 
+import orjson
+
+from shared import SNAPSHOT_CACHE_SIZE, flight_record, read_json, settled_mtime, snapshot_states
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _to_flight_dict(state: List, snapshot: Dict) -> Dict:
+    """Convert an OpenSky state vector into a flight record tagged with its snapshot"""
+    return {
+        **flight_record(state),
+        "timestamp": snapshot["timestamp"],
+        "region": snapshot["region"]
+    }
+
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _load_snapshot_cached(path: str, mtime_ns: int) -> Dict:
+    """Parsed snapshot, cached per (path, mtime) and shared between callers;
+    must not be mutated."""
+    return read_json(path)
+
+
+def _load_snapshot(path: Path) -> Dict:
+    return _load_snapshot_cached(str(path), path.stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _region_flights_cached(path: str, mtime_ns: int) -> List[Dict]:
+    """Flight list of one snapshot as served by the region snapshot tool.
+    Shared between callers like the snapshot itself; must not be mutated."""
+    snapshot = _load_snapshot_cached(path, mtime_ns)
+    return [flight_record(state) for state in snapshot_states(snapshot)]
+
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _region_flights_json_cached(path: str, mtime_ns: int) -> bytes:
+    """The region snapshot tool's flight list of one snapshot, encoded once as JSON"""
+    return orjson.dumps(_region_flights_cached(path, mtime_ns))
+
+
+@lru_cache(maxsize=SNAPSHOT_CACHE_SIZE)
+def _index_entries_cached(path: str, mtime_ns: int) -> Tuple[Dict, Dict]:
+    """Callsign and icao24 index entries of one snapshot (first state wins).
+    Shared between index rebuilds; must not be mutated."""
+    snapshot = _load_snapshot_cached(path, mtime_ns)
+    snapshot_path = Path(path)
+    by_callsign, by_icao = {}, {}
+    add_callsign, add_icao = by_callsign.setdefault, by_icao.setdefault
+    for state in snapshot_states(snapshot):
+        record = _to_flight_dict(state, snapshot)
+        entry = (snapshot_path, record)
+        if state[1]:
+            add_callsign(record["callsign"], entry)  # Already stripped
+        add_icao(state[0], entry)
+    return by_callsign, by_icao
+
+
+def _list_json(directory: Path, prefix: str = "") -> List[Path]:
+    """List {prefix}*.json files in one scandir pass (no per-entry fnmatch)"""
+    with os.scandir(directory) as entries:
+        return [Path(e.path) for e in entries if e.name.startswith(prefix) and e.name.endswith(".json")]
+
+
+def _write_atomic(path: Path, content: bytes):
+    """Write to a temp file and rename it into place so readers never see a partial file"""
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+def _name_order(path: Path) -> Tuple[bool, str]:
+    """Sort key ordering snapshot and alert files chronologically by name alone
+
+    Files are named {prefix}_{epoch_ns:020d}.json, so the suffix compares as a
+    string. Legacy ISO-named files sort before all epoch-named ones.
+    """
+    suffix = path.stem.rsplit("_", 1)[-1]
+    return suffix.isdigit(), suffix
+
+
+def _timestamp_now() -> Tuple[int, str]:
+    """Current time as (epoch nanoseconds, local ISO timestamp)
+
+    Truncated to whole microseconds, so the epoch name and the ISO timestamp
+    stored in the body always refer to the same instant.
+    """
+    ts_ns = time.time_ns() // 1000 * 1000
+    dt = datetime.fromtimestamp(ts_ns // 10**9).replace(microsecond=ts_ns // 1000 % 10**6)
+    return ts_ns, dt.isoformat()
+
+
+def _iso_to_ns(timestamp: str) -> int:
+    """Convert a local ISO timestamp to epoch nanoseconds without float rounding"""
+    dt = datetime.fromisoformat(timestamp)
+    seconds = int(dt.replace(microsecond=0).timestamp())
+    return (seconds * 1_000_000 + dt.microsecond) * 1000
+
+
 class DataStore:
     """Manages flight data snapshots and alerts storage"""
     
@@ -24,120 +122,160 @@ class DataStore:
         self.snapshots_dir.mkdir(parents=True, exist_ok=True)
         self.alerts_dir.mkdir(parents=True, exist_ok=True)
         
+        # Flight lookup indexes over recent snapshots:
+        # callsign / icao24 -> (snapshot path, flight record)
+        self._callsign_idx: Dict[str, Tuple[Path, Dict]] = {}
+        self._icao_idx: Dict[str, Tuple[Path, Dict]] = {}
+        # Snapshot directory mtime the indexes reflect. Any write or cleanup,
+        # from this or another process (e.g. the fetcher), changes it and the
+        # next lookup rebuilds the indexes.
+        self._index_mtime: Optional[int] = None
+        
+        # Time-ordered view of the alert files as (directory mtime, sorted
+        # epoch keys, their paths, legacy ISO-named files older than all of
+        # them). Tools run concurrently in the server's threadpool, so this
+        # and the parsed-file cache below are replaced by a single assignment
+        # and never modified once published.
+        self._alert_timeline_state: Tuple[Optional[int], List[int], List[Path], List[Path]] = (None, [], [], [])
+        # Parsed alert files by epoch key; alert files are never rewritten
+        self._alert_contents: Dict[int, List[Dict]] = {}
+        
         logger.info(f"DataStore initialized: snapshots={self.snapshots_dir}, alerts={self.alerts_dir}")
     
+    def _dir_mtime(self) -> int:
+        return self.snapshots_dir.stat().st_mtime_ns
+    
+    def _ensure_index(self):
+        """Rebuild the flight indexes from the 10 most recent snapshots if the directory changed"""
+        mtime = self._dir_mtime()
+        if mtime == self._index_mtime:
+            return
+        
+        callsign_idx, icao_idx = {}, {}
+        snapshots = sorted(_list_json(self.snapshots_dir), key=_name_order, reverse=True)[:10]
+        
+        # Oldest first so entries from newer snapshots overwrite older ones;
+        # only snapshots not indexed before are parsed
+        for snapshot_file in reversed(snapshots):
+            by_callsign, by_icao = _index_entries_cached(str(snapshot_file), snapshot_file.stat().st_mtime_ns)
+            callsign_idx.update(by_callsign)
+            icao_idx.update(by_icao)
+        
+        self._callsign_idx, self._icao_idx = callsign_idx, icao_idx
+        self._index_mtime = settled_mtime(mtime)
+        logger.info(f"Indexed {len(icao_idx)} flights from {len(snapshots)} snapshots")
+    
     def save_snapshot(self, region_name: str, data: Dict) -> str:
         """Save a flight snapshot for a region"""
-        timestamp = datetime.now().isoformat()
-        filename = f"{region_name}_{timestamp.replace(':', '-')}.json"
+        ts_ns, timestamp = _timestamp_now()
+        filename = f"{region_name}_{ts_ns:020d}.json"
         filepath = self.snapshots_dir / filename
         
         snapshot = {
             "region": region_name,
             "timestamp": timestamp,
+            "timestamp_ns": ts_ns,
             "data": data
         }
         
-        with open(filepath, 'w') as f:
-            json.dump(snapshot, f, indent=2)
+        # Compact output: snapshots are only read back by machines
+        _write_atomic(filepath, orjson.dumps(snapshot))
         
         logger.info(f"Saved snapshot: {filename}")
         return str(filepath)
     
-    def get_latest_snapshot(self, region_name: str) -> Optional[Dict]:
-        """Get the most recent snapshot for a region"""
-        snapshots = list(self.snapshots_dir.glob(f"{region_name}_*.json"))
+    def _latest_snapshot_path(self, region_name: str) -> Optional[Path]:
+        snapshots = _list_json(self.snapshots_dir, f"{region_name}_")
         
         if not snapshots:
             logger.warning(f"No snapshots found for region: {region_name}")
             return None
         
         # Get the most recent file
-        latest = max(snapshots, key=os.path.getmtime)
-        
-        with open(latest, 'r') as f:
-            data = json.load(f)
-        
+        latest = max(snapshots, key=_name_order)
         logger.info(f"Retrieved latest snapshot for {region_name}: {latest.name}")
-        return data
+        return latest
+    
+    def get_latest_snapshot(self, region_name: str) -> Optional[Dict]:
+        """Get the most recent snapshot for a region"""
+        latest = self._latest_snapshot_path(region_name)
+        return _load_snapshot(latest) if latest else None
+    
+    def get_latest_flights(self, region_name: str) -> Optional[Tuple[Dict, List[Dict]]]:
+        """Get the most recent snapshot for a region with its parsed flight list (cached per file)"""
+        latest = self._latest_snapshot_path(region_name)
+        if not latest:
+            return None
+        mtime_ns = latest.stat().st_mtime_ns
+        return _load_snapshot_cached(str(latest), mtime_ns), _region_flights_cached(str(latest), mtime_ns)
+    
+    def get_latest_flights_json(self, region_name: str) -> Optional[Tuple[Dict, List[Dict], bytes]]:
+        """Like get_latest_flights, plus the flight list already encoded as JSON (cached per file)"""
+        latest = self._latest_snapshot_path(region_name)
+        if not latest:
+            return None
+        path, mtime_ns = str(latest), latest.stat().st_mtime_ns
+        return (_load_snapshot_cached(path, mtime_ns), _region_flights_cached(path, mtime_ns),
+                _region_flights_json_cached(path, mtime_ns))
     
     def get_snapshot_by_timestamp(self, region_name: str, timestamp: str) -> Optional[Dict]:
-        """Get a specific snapshot by timestamp"""
-        filename = f"{region_name}_{timestamp.replace(':', '-')}.json"
+        """Get a specific snapshot by timestamp (ISO format or epoch nanoseconds)"""
+        if timestamp.isdigit():
+            filename = f"{region_name}_{int(timestamp):020d}.json"
+        else:
+            try:
+                filename = f"{region_name}_{_iso_to_ns(timestamp):020d}.json"
+            except (ValueError, OverflowError):
+                # Not a parseable ISO timestamp, e.g. the legacy filename form
+                # 2025-01-01T12-00-00.123456
+                filename = None
+            if filename is None or not (self.snapshots_dir / filename).exists():
+                # Snapshot saved under the legacy ISO filename
+                filename = f"{region_name}_{timestamp.replace(':', '-')}.json"
         filepath = self.snapshots_dir / filename
         
         if not filepath.exists():
             logger.warning(f"Snapshot not found: {filename}")
             return None
         
-        with open(filepath, 'r') as f:
-            return json.load(f)
+        return _load_snapshot(filepath)
     
     def get_flight_by_callsign(self, callsign: str) -> Optional[Dict]:
         """Search for a flight by callsign across all recent snapshots"""
-        # Get all snapshots
-        snapshots = sorted(self.snapshots_dir.glob("*.json"), key=os.path.getmtime, reverse=True)
-        
-        # Search through recent snapshots (last 10)
-        for snapshot_file in snapshots[:10]:
-            with open(snapshot_file, 'r') as f:
-                snapshot = json.load(f)
-            
-            if "data" in snapshot and "states" in snapshot["data"]:
-                for state in snapshot["data"]["states"]:
-                    # OpenSky state format: [icao24, callsign, origin_country, ...]
-                    if len(state) > 1 and state[1] and state[1].strip() == callsign.strip():
-                        return {
-                            "callsign": state[1].strip() if state[1] else None,
-                            "icao24": state[0],
-                            "origin_country": state[2],
-                            "longitude": state[5],
-                            "latitude": state[6],
-                            "altitude": state[7],
-                            "velocity": state[9],
-                            "heading": state[10],
-                            "vertical_rate": state[11],
-                            "on_ground": state[8],
-                            "timestamp": snapshot["timestamp"],
-                            "region": snapshot["region"]
-                        }
+        self._ensure_index()
+        entry = self._callsign_idx.get(callsign.strip())
+        if entry:
+            return dict(entry[1])
         
         logger.warning(f"Flight not found: {callsign}")
         return None
     
     def get_flight_by_icao24(self, icao24: str) -> Optional[Dict]:
         """Search for a flight by ICAO24 address"""
-        snapshots = sorted(self.snapshots_dir.glob("*.json"), key=os.path.getmtime, reverse=True)
-        
-        for snapshot_file in snapshots[:10]:
-            with open(snapshot_file, 'r') as f:
-                snapshot = json.load(f)
-            
-            if "data" in snapshot and "states" in snapshot["data"]:
-                for state in snapshot["data"]["states"]:
-                    if len(state) > 0 and state[0] == icao24:
-                        return {
-                            "callsign": state[1].strip() if state[1] else None,
-                            "icao24": state[0],
-                            "origin_country": state[2],
-                            "longitude": state[5],
-                            "latitude": state[6],
-                            "altitude": state[7],
-                            "velocity": state[9],
-                            "heading": state[10],
-                            "vertical_rate": state[11],
-                            "on_ground": state[8],
-                            "timestamp": snapshot["timestamp"],
-                            "region": snapshot["region"]
-                        }
+        self._ensure_index()
+        entry = self._icao_idx.get(icao24)
+        if entry:
+            return dict(entry[1])
         
         logger.warning(f"Flight not found: {icao24}")
         return None
     
+    def find_flight(self, query: str) -> Optional[Dict]:
+        """Search for a flight by callsign, falling back to ICAO24 address, with one index check"""
+        self._ensure_index()
+        query = query.strip()
+        # ICAO24 addresses are stored as lowercase hex
+        entry = self._callsign_idx.get(query) or self._icao_idx.get(query.lower())
+        if entry:
+            return dict(entry[1])
+        
+        logger.warning(f"Flight not found: {query}")
+        return None
+    
     def save_alert(self, alert_data: Dict) -> str:
         """Save an anomaly alert"""
-        timestamp = datetime.now().isoformat()
-        alert_id = f"alert_{timestamp.replace(':', '-')}"
+        ts_ns, timestamp = _timestamp_now()
+        alert_id = f"alert_{ts_ns:020d}"
         filename = f"{alert_id}.json"
         filepath = self.alerts_dir / filename
         
@@ -147,26 +285,89 @@ class DataStore:
             **alert_data
         }
         
-        with open(filepath, 'w') as f:
-            json.dump(alert, f, indent=2)
+        _write_atomic(filepath, orjson.dumps(alert))
         
         logger.info(f"Saved alert: {alert_id}")
         return alert_id
     
+    def save_alerts_batch(self, alerts_data: List[Dict]) -> List[str]:
+        """Save several anomaly alerts with a single file write"""
+        if not alerts_data:
+            return []
+        
+        ts_ns, timestamp = _timestamp_now()
+        batch_id = f"alert_{ts_ns:020d}"
+        filepath = self.alerts_dir / f"{batch_id}.json"
+        
+        alerts = [
+            {"alert_id": f"{batch_id}_{i}", "timestamp": timestamp, **alert_data}
+            for i, alert_data in enumerate(alerts_data)
+        ]
+        
+        # One file holding a list; readers accept both single alerts and batches
+        _write_atomic(filepath, orjson.dumps(alerts))
+        
+        logger.info(f"Saved {len(alerts)} alerts: {batch_id}")
+        return [alert["alert_id"] for alert in alerts]
+    
+    def _alert_timeline(self) -> Tuple[List[int], List[Path], List[Path]]:
+        """Alert files in time order as (epoch keys, epoch-named paths, legacy paths)"""
+        mtime = self.alerts_dir.stat().st_mtime_ns
+        known_mtime, keys, paths, legacy = self._alert_timeline_state
+        if mtime != known_mtime:
+            epoch, legacy = [], []
+            for alert_file in _list_json(self.alerts_dir, "alert_"):
+                is_epoch, suffix = _name_order(alert_file)
+                if is_epoch:
+                    epoch.append((int(suffix), alert_file))
+                else:
+                    legacy.append(alert_file)
+            epoch.sort()
+            
+            keys = [key for key, _ in epoch]
+            paths = [path for _, path in epoch]
+            self._alert_timeline_state = (settled_mtime(mtime), keys, paths, legacy)
+        
+        return keys, paths, legacy
+    
     def get_active_alerts(self, max_age_hours: int = 24) -> List[Dict]:
         """Get all active alerts within the specified time window"""
         from datetime import timedelta
         
         cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
+        now_ns = time.time_ns()
+        cutoff_ns = now_ns - max_age_hours * 3600 * 10**9
         alerts = []
         
-        for alert_file in self.alerts_dir.glob("alert_*.json"):
-            with open(alert_file, 'r') as f:
-                alert = json.load(f)
-            
-            alert_time = datetime.fromisoformat(alert["timestamp"])
-            if alert_time >= cutoff_time:
-                alerts.append(alert)
+        # Binary-search the first alert file inside the window; everything
+        # after it is newer
+        keys, paths, legacy = self._alert_timeline()
+        start = bisect_left(keys, cutoff_ns)
+        
+        cache, parsed = self._alert_contents, {}
+        for key, alert_file in zip(keys[start:], paths[start:]):
+            batch = cache.get(key)
+            if batch is None:
+                content = orjson.loads(alert_file.read_bytes())
+                batch = parsed[key] = content if isinstance(content, list) else [content]
+            alerts.extend(batch)
+        
+        # Legacy ISO-named alerts predate every epoch-named one, so they can
+        # only be active if no epoch-named alert has expired yet
+        if start == 0:
+            for alert_file in legacy:
+                content = orjson.loads(alert_file.read_bytes())
+                batch = content if isinstance(content, list) else [content]
+                alerts.extend(a for a in batch if datetime.fromisoformat(a["timestamp"]) >= cutoff_time)
+        
+        # Publish newly parsed files, forgetting those that have left both
+        # this and the default window. A concurrent call may publish over
+        # this one, which only costs a re-parse later.
+        keep_from = min(cutoff_ns, now_ns - 24 * 3600 * 10**9)
+        if parsed or (cache and min(cache) < keep_from):
+            contents = {k: v for k, v in cache.items() if k >= keep_from}
+            contents.update(parsed)
+            self._alert_contents = contents
         
         # Sort by timestamp, most recent first
         alerts.sort(key=lambda x: x["timestamp"], reverse=True)
@@ -176,7 +377,7 @@ class DataStore:
     
     def cleanup_old_snapshots(self, max_snapshots: int = 100):
         """Remove old snapshots, keeping only the most recent ones"""
-        snapshots = sorted(self.snapshots_dir.glob("*.json"), key=os.path.getmtime, reverse=True)
+        snapshots = sorted(_list_json(self.snapshots_dir), key=_name_order, reverse=True)
         
         if len(snapshots) > max_snapshots:
             for old_snapshot in snapshots[max_snapshots:]:
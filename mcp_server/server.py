@@ -3,24 +3,31 @@ MCP Server - FastAPI Application
 Exposes flight data and alerts as MCP tools via HTTP endpoints
 """
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import Optional
 import uvicorn
 import os
 from dotenv import load_dotenv
 
+from json_response import ORJSONResponse
+
 from .data_store import DataStore
 from .tools import MCPTools, get_tool_definitions
 
 # Load environment variables
 load_dotenv()
 
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Airspace Copilot MCP Server",
     description="Model Context Protocol server for flight data and alerts",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -32,6 +39,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses: region snapshots embed the full OpenSky state
+# arrays, which are highly repetitive numeric JSON
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Initialize data store and tools
 data_store = DataStore(
     snapshots_dir=os.getenv("DATA_STORE_PATH", "./data/snapshots"),
@@ -40,6 +51,14 @@ data_store = DataStore(
 mcp_tools = MCPTools(data_store)
 
 
+async def _call(tool, *args):
+    """Run a blocking MCP tool in the threadpool, mapping failures to HTTP 500"""
+    try:
+        return await run_in_threadpool(tool, *args)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # Pydantic models for request/response
 class RegionSnapshotRequest(BaseModel):
     region_name: str
@@ -83,69 +102,52 @@ async def list_tools():
 @app.post("/tools/flights/list_region_snapshot")
 async def list_region_snapshot(request: RegionSnapshotRequest):
     """Get the most recent snapshot for a region"""
-    try:
-        result = mcp_tools.list_region_snapshot(request.region_name)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Pre-encoded: the flight list is serialized once per snapshot file
+    content = await _call(mcp_tools.list_region_snapshot_json, request.region_name)
+    return Response(content, media_type="application/json")
 
 
 @app.post("/tools/flights/get_by_callsign")
 async def get_by_callsign(request: FlightCallsignRequest):
     """Get flight data by callsign or ICAO24"""
-    try:
-        result = mcp_tools.get_by_callsign(request.callsign)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _call(mcp_tools.get_by_callsign, request.callsign)
 
 
 @app.post("/tools/alerts/list_active")
 async def list_active_alerts(request: AlertsRequest):
     """Get active anomaly alerts"""
-    try:
-        result = mcp_tools.list_active_alerts(request.max_age_hours)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _call(mcp_tools.list_active_alerts, request.max_age_hours)
 
 
 # Convenience GET endpoints
 @app.get("/tools/flights/list_region_snapshot/{region_name}")
 async def get_region_snapshot(region_name: str):
     """GET version of region snapshot"""
-    try:
-        result = mcp_tools.list_region_snapshot(region_name)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Pre-encoded: the flight list is serialized once per snapshot file
+    content = await _call(mcp_tools.list_region_snapshot_json, region_name)
+    return Response(content, media_type="application/json")
 
 
 @app.get("/tools/flights/get_by_callsign/{callsign}")
 async def get_flight(callsign: str):
     """GET version of flight lookup"""
-    try:
-        result = mcp_tools.get_by_callsign(callsign)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _call(mcp_tools.get_by_callsign, callsign)
 
 
 @app.get("/tools/alerts/list_active")
 async def get_active_alerts(max_age_hours: int = 24):
     """GET version of active alerts"""
-    try:
-        result = mcp_tools.list_active_alerts(max_age_hours)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await _call(mcp_tools.list_active_alerts, max_age_hours)
 
 
 if __name__ == "__main__":
     host = os.getenv("MCP_SERVER_HOST", "localhost")
     port = int(os.getenv("MCP_SERVER_PORT", 8000))
+    workers = int(os.getenv("MCP_WORKERS", 1))
     
-    print(f"🚀 Starting MCP Server on http://{host}:{port}")
+    print(f"🚀 Starting MCP Server on http://{host}:{port} ({workers} worker(s))")
     print(f"📖 API Documentation: http://{host}:{port}/docs")
     
-    uvicorn.run(app, host=host, port=port, log_level="info")
+    # Import string so uvicorn can spawn worker processes; each worker keeps
+    # its own DataStore caches. uvicorn[standard] selects uvloop and httptools.
+    uvicorn.run("mcp_server.server:app", host=host, port=port, workers=workers, log_level="info")
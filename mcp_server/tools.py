@@ -6,6 +6,8 @@ from typing import Dict, List, Optional
 from .data_store import DataStore
 import logging
 
+import orjson
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -30,34 +32,13 @@ class MCPTools:
         """
         logger.info(f"Tool called: list_region_snapshot(region_name={region_name})")
         
-        snapshot = self.data_store.get_latest_snapshot(region_name)
+        latest = self.data_store.get_latest_flights(region_name)
         
-        if not snapshot:
-            return {
-                "success": False,
-                "error": f"No snapshot found for region: {region_name}",
-                "region": region_name,
-                "flights": []
-            }
+        if not latest:
+            return _snapshot_not_found(region_name)
         
-        # Parse and structure the data
-        flights = []
-        if "data" in snapshot and "states" in snapshot["data"]:
-            for state in snapshot["data"]["states"]:
-                if len(state) >= 12:
-                    flight = {
-                        "icao24": state[0],
-                        "callsign": state[1].strip() if state[1] else None,
-                        "origin_country": state[2],
-                        "longitude": state[5],
-                        "latitude": state[6],
-                        "altitude": state[7],
-                        "on_ground": state[8],
-                        "velocity": state[9],
-                        "heading": state[10],
-                        "vertical_rate": state[11]
-                    }
-                    flights.append(flight)
+        # Flights are parsed once per snapshot file and reused across calls
+        snapshot, flights = latest
         
         return {
             "success": True,
@@ -67,6 +48,38 @@ class MCPTools:
             "flights": flights
         }
     
+    def list_region_snapshot_json(self, region_name: str) -> bytes:
+        """
+        Tool: flights.list_region_snapshot, serialized as JSON
+        
+        Same response as list_region_snapshot. The encoded flight list is
+        cached per snapshot file and spliced in, so repeated calls only
+        encode the few top-level fields.
+        
+        Args:
+            region_name: Name of the region (e.g., "region1", "region2")
+        
+        Returns:
+            UTF-8 JSON bytes of the tool response
+        """
+        logger.info(f"Tool called: list_region_snapshot(region_name={region_name})")
+        
+        latest = self.data_store.get_latest_flights_json(region_name)
+        
+        if not latest:
+            return orjson.dumps(_snapshot_not_found(region_name))
+        
+        snapshot, flights, flights_json = latest
+        head = orjson.dumps({
+            "success": True,
+            "region": region_name,
+            "timestamp": snapshot.get("timestamp"),
+            "total_flights": len(flights)
+        })
+        
+        # Append "flights" as the last key, as in list_region_snapshot
+        return head[:-1] + b',"flights":' + flights_json + b"}"
+    
     def get_by_callsign(self, callsign: str) -> Dict:
         """
         Tool: flights.get_by_callsign
@@ -80,12 +93,8 @@ class MCPTools:
         """
         logger.info(f"Tool called: get_by_callsign(callsign={callsign})")
         
-        # Try callsign first
-        flight = self.data_store.get_flight_by_callsign(callsign)
-        
-        # If not found, try ICAO24
-        if not flight:
-            flight = self.data_store.get_flight_by_icao24(callsign)
+        # Callsign first, then ICAO24
+        flight = self.data_store.find_flight(callsign)
         
         if not flight:
             return {
@@ -121,54 +130,66 @@ class MCPTools:
         }
 
 
-# Tool registry for MCP server
-def get_tool_definitions() -> List[Dict]:
-    """Returns tool definitions in MCP format"""
-    return [
-        {
-            "name": "flights.list_region_snapshot",
-            "description": "Returns the most recent flight snapshot for a specified region, including all current flights with their positions, altitudes, speeds, and headings.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "region_name": {
-                        "type": "string",
-                        "description": "Name of the region to query (e.g., 'region1', 'region2')"
-                    }
-                },
-                "required": ["region_name"]
-            }
-        },
-        {
-            "name": "flights.get_by_callsign",
-            "description": "Finds and returns the latest data for a specific flight by its callsign or ICAO24 identifier.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "callsign": {
-                        "type": "string",
-                        "description": "Flight callsign (e.g., 'UAL123') or ICAO24 address (e.g., '4baa1a')"
-                    }
-                },
-                "required": ["callsign"]
-            }
-        },
-        {
-            "name": "alerts.list_active",
-            "description": "Returns all currently active anomaly alerts, including unusual flight patterns, speed anomalies, or altitude issues.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "max_age_hours": {
-                        "type": "integer",
-                        "description": "Maximum age of alerts to retrieve in hours (default: 24)",
-                        "default": 24
-                    }
-                },
-                "required": []
-            }
+def _snapshot_not_found(region_name: str) -> Dict:
+    return {
+        "success": False,
+        "error": f"No snapshot found for region: {region_name}",
+        "region": region_name,
+        "flights": []
+    }
+
+
+# Tool registry for MCP server, built once at import
+_TOOL_DEFINITIONS: List[Dict] = [
+    {
+        "name": "flights.list_region_snapshot",
+        "description": "Returns the most recent flight snapshot for a specified region, including all current flights with their positions, altitudes, speeds, and headings.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "region_name": {
+                    "type": "string",
+                    "description": "Name of the region to query (e.g., 'region1', 'region2')"
+                }
+            },
+            "required": ["region_name"]
+        }
+    },
+    {
+        "name": "flights.get_by_callsign",
+        "description": "Finds and returns the latest data for a specific flight by its callsign or ICAO24 identifier.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "callsign": {
+                    "type": "string",
+                    "description": "Flight callsign (e.g., 'UAL123') or ICAO24 address (e.g., '4baa1a')"
+                }
+            },
+            "required": ["callsign"]
         }
-    ]
+    },
+    {
+        "name": "alerts.list_active",
+        "description": "Returns all currently active anomaly alerts, including unusual flight patterns, speed anomalies, or altitude issues.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "max_age_hours": {
+                    "type": "integer",
+                    "description": "Maximum age of alerts to retrieve in hours (default: 24)",
+                    "default": 24
+                }
+            },
+            "required": []
+        }
+    }
+]
+
+
+def get_tool_definitions() -> List[Dict]:
+    """Returns tool definitions in MCP format (shared; callers must not mutate)"""
+    return _TOOL_DEFINITIONS
 
 
 if __name__ == "__main__":
@@ -3,14 +3,20 @@ OpenSky API Fetcher
 Fetches flight data from OpenSky Network API and stores snapshots
 """
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
 import time
 import json
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
 import logging
 import sys
 import os
 
+import orjson
+
 # Add parent directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
@@ -18,20 +24,87 @@ from mcp_server.data_store import DataStore
 # Import anomaly_detector module directly to avoid importing agent_config
 import agents.anomaly_detector
 AnomalyDetector = agents.anomaly_detector.AnomalyDetector
+from agents.flight_arrays import FlightsSoA
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def union_bounding_box(region_configs: Dict) -> Optional[Dict]:
+    """Smallest box covering every region (None if any region is unbounded)"""
+    boxes = list(region_configs.values())
+    if not boxes or not all(boxes):
+        return None
+    return {
+        "min_lat": min(b["min_lat"] for b in boxes),
+        "max_lat": max(b["max_lat"] for b in boxes),
+        "min_lon": min(b["min_lon"] for b in boxes),
+        "max_lon": max(b["max_lon"] for b in boxes)
+    }
+
+
 class OpenSkyFetcher:
     """Fetches data from OpenSky Network API"""
     
     BASE_URL = "https://opensky-network.org/api/states/all"
+    TOKEN_URL = "https://auth.opensky-network.org/auth/realms/opensky-network/protocol/openid-connect/token"
     
-    def __init__(self, data_store: DataStore):
+    # OpenSky state vectors only advance every 10 seconds (anonymous resolution)
+    STATE_RESOLUTION_SECONDS = 10
+    
+    # Backoff after a 429 without a Retry-After hint: doubles per consecutive 429
+    MIN_BACKOFF_SECONDS = 60
+    MAX_BACKOFF_SECONDS = 3600
+    
+    def __init__(self, data_store: DataStore, client_id: Optional[str] = None, client_secret: Optional[str] = None):
         self.data_store = data_store
         self.detector = AnomalyDetector()
-        logger.info("OpenSky Fetcher initialized")
+        
+        # OAuth2 client credentials for authenticated access (anonymous if unset)
+        self.client_id = client_id or os.getenv("OPENSKY_CLIENT_ID")
+        self.client_secret = client_secret or os.getenv("OPENSKY_CLIENT_SECRET")
+        self._token = None
+        self._token_expiry = 0.0
+        
+        # Last successful fetch: (request key, time bucket, OpenSky "time", results)
+        self._last_fetch: Optional[Tuple] = None
+        
+        # Rate limiting state, from OpenSky's X-Rate-Limit-* response headers
+        self.remaining_credits: Optional[int] = None
+        self._backoff = 0.0
+        self._backoff_until = 0.0
+        
+        # Anomaly detection and alert writes run off the fetch path on a single
+        # worker, so the detector's per-flight history is updated in fetch order
+        self._anomaly_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anomalies")
+        
+        # Persistent session: keeps the TLS connection to OpenSky alive between fetches
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=2))
+        # Offer every encoding urllib3 can decode here (adds br/zstd when the
+        # brotli/zstandard packages are installed); state arrays compress well
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        
+        logger.info(f"OpenSky Fetcher initialized ({'authenticated' if self.client_id else 'anonymous'})")
+    
+    def _auth_headers(self) -> Dict:
+        """Bearer token header for authenticated access, refreshing the token when it expires"""
+        if not (self.client_id and self.client_secret):
+            return {}
+        
+        if time.time() >= self._token_expiry:
+            response = self.session.post(self.TOKEN_URL, data={
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret
+            }, timeout=15)
+            response.raise_for_status()
+            token = response.json()
+            self._token = token["access_token"]
+            # Refresh a minute early so a request never carries an expired token
+            self._token_expiry = time.time() + token.get("expires_in", 1800) - 60
+        
+        return {"Authorization": f"Bearer {self._token}"}
     
     def fetch_region(self, region_name: str, bounding_box: Optional[Dict] = None) -> Dict:
         """
@@ -44,6 +117,23 @@ class OpenSkyFetcher:
         Returns:
             Dictionary with flight data
         """
+        # The API already restricts the response to the box
+        return self.fetch_regions({region_name: None}, bounding_box)[region_name]
+    
+    def fetch_regions(self, region_configs: Dict, bounding_box: Optional[Dict] = None,
+                      wait_for_anomalies: bool = True) -> Dict[str, Dict]:
+        """
+        Fetch several regions with a single API call and split the flights locally
+        
+        Args:
+            region_configs: Dict mapping region names to bounding boxes (None = all fetched flights)
+            bounding_box: Optional box sent to the API (None = all flights worldwide)
+            wait_for_anomalies: Wait for anomaly detection and include the counts in the
+                results; otherwise detection finishes in the background and is only logged
+        
+        Returns:
+            Dict mapping region names to per-region results
+        """
         try:
             # Build query parameters
             params = {}
@@ -55,94 +145,157 @@ class OpenSkyFetcher:
                     "lomax": bounding_box.get("max_lon")
                 }
             
-            logger.info(f"Fetching data for {region_name} with params: {params}")
+            # Within one resolution window OpenSky would return the same states
+            request_key = json.dumps([params, region_configs], sort_keys=True)
+            bucket = int(time.time() // self.STATE_RESOLUTION_SECONDS)
+            last = self._last_fetch
+            if last and last[0] == request_key and last[1] == bucket:
+                logger.info("OpenSky data not updated yet, reusing last fetch")
+                return {region_name: dict(result) for region_name, result in last[3].items()}
             
-            # Make request
-            response = requests.get(self.BASE_URL, params=params, timeout=15)
-            
-            # Handle rate limiting
-            if response.status_code == 429:
-                logger.warning("Rate limited by OpenSky API")
-                return {
+            # Still backing off from a 429: asking again now only burns more quota
+            if time.time() < self._backoff_until:
+                wait = self._backoff_until - time.time()
+                logger.warning(f"Rate limited, backing off for another {wait:.0f}s")
+                return {region_name: {
                     "success": False,
                     "error": "Rate limited",
-                    "status_code": 429
-                }
+                    "status_code": 429,
+                    "retry_after": round(wait)
+                } for region_name in region_configs}
             
-            response.raise_for_status()
-            data = response.json()
-            
-            logger.info(f"Successfully fetched {len(data.get('states', []))} flights")
+            logger.info(f"Fetching data for {', '.join(region_configs)} with params: {params}")
             
-            # Save snapshot
-            self.data_store.save_snapshot(region_name, data)
+            # Make request
+            response = self.session.get(self.BASE_URL, params=params, headers=self._auth_headers(), timeout=15)
             
-            # Detect anomalies
-            flights = self._parse_flights(data)
-            anomalies = self.detector.detect_anomalies(flights)
+            remaining = response.headers.get("X-Rate-Limit-Remaining")
+            if remaining is not None and remaining.isdigit():
+                self.remaining_credits = int(remaining)
             
-            # Save anomalies as alerts
-            for anomaly in anomalies:
-                alert_data = {
-                    "region": region_name,
-                    "callsign": anomaly["flight"].get("callsign"),
-                    "icao24": anomaly["flight"].get("icao24"),
-                    "anomaly_type": anomaly["anomaly_type"],
-                    "severity": anomaly["severity"],
-                    "description": anomaly["description"],
-                    "flight_data": anomaly["flight"]
+            # Handle rate limiting
+            if response.status_code == 429:
+                wait = self._start_backoff(response.headers.get("X-Rate-Limit-Retry-After-Seconds"))
+                logger.warning(f"Rate limited by OpenSky API, backing off for {wait:.0f}s")
+                failure = {
+                    "success": False,
+                    "error": "Rate limited",
+                    "status_code": 429,
+                    "retry_after": round(wait)
                 }
-                self.data_store.save_alert(alert_data)
-            
-            return {
-                "success": True,
-                "region": region_name,
-                "timestamp": datetime.now().isoformat(),
-                "total_flights": len(flights),
-                "anomalies": len(anomalies)
-            }
+            else:
+                response.raise_for_status()
+                self._backoff = 0.0
+                data = orjson.loads(response.content)
+                
+                wire_bytes = response.headers.get("Content-Length")
+                encoding = response.headers.get("Content-Encoding")
+                size = f"{len(response.content) / 1024:.0f} KB"
+                if encoding and wire_bytes and wire_bytes.isdigit():
+                    size += f", {int(wire_bytes) / 1024:.0f} KB {encoding} on the wire"
+                logger.info(f"Successfully fetched {len(data.get('states') or [])} flights ({size})")
+                
+                # Same OpenSky timestamp: these states were already stored and checked
+                if last and last[0] == request_key and data.get("time") is not None and data.get("time") == last[2]:
+                    logger.info("OpenSky data unchanged since last fetch, skipping processing")
+                    results = last[3]
+                else:
+                    flights = self._parse_flights(data)
+                    results = {
+                        region_name: self._store_region(region_name, data, flights, region_box, wait_for_anomalies)
+                        for region_name, region_box in region_configs.items()
+                    }
+                
+                self._last_fetch = (request_key, bucket, data.get("time"), results)
+                return {region_name: dict(result) for region_name, result in results.items()}
             
         except requests.exceptions.Timeout:
             logger.error("Request timeout")
-            return {
+            failure = {
                 "success": False,
                 "error": "Request timeout"
             }
         except requests.exceptions.RequestException as e:
             logger.error(f"Request failed: {e}")
-            return {
+            failure = {
                 "success": False,
                 "error": str(e)
             }
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
-            return {
+            failure = {
                 "success": False,
                 "error": str(e)
             }
+        
+        return {region_name: dict(failure) for region_name in region_configs}
     
-    def _parse_flights(self, opensky_data: Dict) -> list:
-        """Parse OpenSky response into structured flight list"""
-        flights = []
-        
-        if "states" in opensky_data and opensky_data["states"]:
-            for state in opensky_data["states"]:
-                if len(state) >= 12:
-                    flight = {
-                        "icao24": state[0],
-                        "callsign": state[1].strip() if state[1] else None,
-                        "origin_country": state[2],
-                        "longitude": state[5],
-                        "latitude": state[6],
-                        "altitude": state[7],
-                        "on_ground": state[8],
-                        "velocity": state[9],
-                        "heading": state[10],
-                        "vertical_rate": state[11]
-                    }
-                    flights.append(flight)
+    def _start_backoff(self, retry_after: Optional[str]) -> float:
+        """Schedule the next allowed request after a 429 and return the wait in seconds"""
+        if retry_after is not None and retry_after.isdigit():
+            # OpenSky says exactly when credits are available again
+            wait = float(retry_after)
+        else:
+            self._backoff = min(max(self._backoff * 2, self.MIN_BACKOFF_SECONDS), self.MAX_BACKOFF_SECONDS)
+            wait = self._backoff * random.uniform(0.8, 1.2)  # Jitter
+        self._backoff_until = time.time() + wait
+        return wait
+    
+    def _store_region(self, region_name: str, data: Dict, flights: FlightsSoA,
+                      bounding_box: Optional[Dict], wait_for_anomalies: bool) -> Dict:
+        """Save one region's share of a fetch as a snapshot and queue its anomaly checks"""
+        if bounding_box:
+            flights = flights.take(flights.within(bounding_box))
+            data = {**data, "states": flights.states}
+        
+        # Save snapshot
+        self.data_store.save_snapshot(region_name, data)
         
-        return flights
+        # Detect anomalies on the worker
+        future = self._anomaly_worker.submit(self._record_anomalies, region_name, flights)
+        
+        result = {
+            "success": True,
+            "region": region_name,
+            "timestamp": datetime.now().isoformat(),
+            "total_flights": len(flights)
+        }
+        if wait_for_anomalies:
+            result["anomalies"] = future.result()
+        else:
+            future.add_done_callback(lambda done: self._log_anomalies(region_name, done))
+        return result
+    
+    def _record_anomalies(self, region_name: str, flights: FlightsSoA) -> int:
+        """Detect anomalies in one region's flights and save them as alerts"""
+        anomalies = self.detector.detect_anomalies(flights)
+        
+        # Save anomalies as alerts, one write per region
+        self.data_store.save_alerts_batch([
+            {
+                "region": region_name,
+                "callsign": anomaly["flight"].get("callsign"),
+                "icao24": anomaly["flight"].get("icao24"),
+                "anomaly_type": anomaly["anomaly_type"],
+                "severity": anomaly["severity"],
+                "description": anomaly["description"],
+                "flight_data": anomaly["flight"]
+            }
+            for anomaly in anomalies
+        ])
+        
+        return len(anomalies)
+    
+    @staticmethod
+    def _log_anomalies(region_name: str, future: Future):
+        try:
+            logger.info(f"🔎 {region_name}: {future.result()} anomalies")
+        except Exception as e:
+            logger.error(f"❌ {region_name}: anomaly detection failed: {e}")
+    
+    def _parse_flights(self, opensky_data: Dict) -> FlightsSoA:
+        """Parse OpenSky response into per-field flight arrays"""
+        return FlightsSoA.from_states(opensky_data.get("states"))
     
     def fetch_loop(self, region_configs: Dict, interval_seconds: int = 60):
         """
@@ -154,20 +307,31 @@ class OpenSkyFetcher:
         """
         logger.info(f"Starting fetch loop with {len(region_configs)} regions, interval: {interval_seconds}s")
         
+        # One request per interval covering all regions; they are split out locally
+        bounding_box = union_bounding_box(region_configs)
+        
         while True:
-            for region_name, bounding_box in region_configs.items():
-                result = self.fetch_region(region_name, bounding_box)
-                
+            # Fixed-rate schedule: the time spent fetching counts towards the
+            # interval instead of being added to it
+            started = time.monotonic()
+            
+            # Anomaly detection overlaps the sleep; the worker logs the counts
+            results = self.fetch_regions(region_configs, bounding_box, wait_for_anomalies=False)
+            
+            for region_name, result in results.items():
                 if result["success"]:
-                    logger.info(f"✅ {region_name}: {result['total_flights']} flights, {result['anomalies']} anomalies")
+                    logger.info(f"✅ {region_name}: {result['total_flights']} flights")
                 else:
                     logger.error(f"❌ {region_name}: {result.get('error')}")
-                
-                # Small delay between regions to avoid rate limiting
-                time.sleep(2)
             
-            logger.info(f"Sleeping for {interval_seconds} seconds...")
-            time.sleep(interval_seconds)
+            # Never wake up before a rate-limit backoff has expired
+            sleep_seconds = max(started + interval_seconds - time.monotonic(),
+                                self._backoff_until - time.time(), 0)
+            if self.remaining_credits is not None:
+                logger.info(f"Sleeping for {sleep_seconds:.0f} seconds ({self.remaining_credits} API credits left)...")
+            else:
+                logger.info(f"Sleeping for {sleep_seconds:.0f} seconds...")
+            time.sleep(sleep_seconds)
 
 
 # Predefined regions (examples - can be customized)
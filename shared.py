@@ -0,0 +1,70 @@
+"""
+Shared Helpers
+Snapshot file I/O and OpenSky state vector parsing, used by backend_api,
+mcp_server and the agents' flight arrays
+"""
+import mmap
+import os
+import time
+from typing import Dict, List, Optional
+
+import orjson
+
+# Files at least this large are parsed from a read-only memory map, skipping
+# the copy into a bytes object; small alert files are read normally
+MMAP_MIN_BYTES = 64 * 1024
+
+# An OpenSky state vector has at least this many fields for the ones we use
+MIN_STATE_LENGTH = 12
+
+# Entries per parsed-snapshot cache. Readers only touch the 10 newest
+# snapshots (flight lookups) and the latest one per region; each entry is a
+# fully parsed snapshot or a copy derived from it, so anything beyond that
+# working set only holds memory that is never read again.
+SNAPSHOT_CACHE_SIZE = 16
+
+
+def read_json(path: str):
+    """Parse a JSON file, straight from the page cache for large files"""
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size < MMAP_MIN_BYTES:
+            return orjson.loads(fh.read())
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+
+def snapshot_states(snapshot: Dict) -> List[List]:
+    """State vectors of a snapshot, or [] if there are none or they are too short
+
+    OpenSky's state vector layout is fixed, so the length is checked once on
+    the first state instead of per flight.
+    """
+    # OpenSky sends "states": null when a region has no flights
+    states = snapshot.get("data", {}).get("states") or []
+    return states if states and len(states[0]) >= MIN_STATE_LENGTH else []
+
+
+def flight_record(state: List) -> Dict:
+    """Convert an OpenSky state vector into a flight record"""
+    return {
+        "icao24": state[0],
+        "callsign": state[1].strip() if state[1] else None,
+        "origin_country": state[2],
+        "longitude": state[5],
+        "latitude": state[6],
+        "altitude": state[7],
+        "on_ground": state[8],
+        "velocity": state[9],
+        "heading": state[10],
+        "vertical_rate": state[11]
+    }
+
+
+def settled_mtime(mtime_ns: int) -> Optional[int]:
+    """Directory mtime to remember for a listing, or None to rescan next time
+
+    Directory mtimes are coarse, so a file written in the same tick as the
+    listing would not change it. Only trust a directory that has been quiet
+    for a second.
+    """
+    return mtime_ns if time.time_ns() - mtime_ns > 10**9 else None